@@ -1,14 +1,145 @@
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import GoogleAPICallError, NotFound
+from google.api_core.future import polling
 import google.cloud.compute_v1 as compute_v1
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from gcp_state_cache import cache_resource, get_cached_resource, invalidate_cached_resource
 import argparse
-import time
+import concurrent.futures
+import functools
+import json
+import mmap
+from dataclasses import dataclass
+from pathlib import Path
 import sys # For sys.exit
 
+# ##################################
+# # Operation Handling           #
+# ##################################
+
+# api-core samples each polling delay uniformly from [0, cap], so parallel deployments do not
+# poll the Compute API in lockstep. The cap starts at 1s and doubles up to 20s: a long operation
+# averages one GET every 10s once capped, half as many as a fixed 5s poll.
+OPERATION_POLLING = polling.DEFAULT_POLLING.with_delay(initial=1.0, maximum=20.0, multiplier=2.0)
+
+def _await_operation(operation, *, timeout_s: float, op_kind: str) -> bool:
+    """
+    Waits for a compute_v1 extended operation to finish and reports the outcome.
+
+    Args:
+        operation: The extended operation returned by a compute_v1 insert/update call.
+        timeout_s: Seconds to wait before giving up.
+        op_kind: Human-readable description used in messages (e.g., "instance creation for 'vm'").
+
+    Returns:
+        True if the operation completed without error, False on error or timeout.
+    """
+    print(f"INFO: Waiting for {op_kind} operation '{operation.name}' to complete...")
+    try:
+        operation.result(timeout=timeout_s, polling=OPERATION_POLLING)
+    except concurrent.futures.TimeoutError:
+        print(f"ERROR: Timeout waiting for {op_kind} after {timeout_s:.0f}s.")
+        return False
+    except GoogleAPICallError as e: # Raised when the operation finishes with an error
+        print(f"ERROR: {op_kind} failed. Error: {e}")
+        return False
+    return True
+
+# ##################################
+# # Shared API Clients           #
+# ##################################
+
+# Each client is built once per process, so its transport, credentials and
+# connection pool are reused by every step instead of being set up per call.
+
+@functools.lru_cache(maxsize=None)
+def _instances_client() -> compute_v1.InstancesClient:
+    return compute_v1.InstancesClient()
+
+@functools.lru_cache(maxsize=None)
+def _addresses_client() -> compute_v1.AddressesClient:
+    return compute_v1.AddressesClient()
+
+@functools.lru_cache(maxsize=None)
+def _firewalls_client() -> compute_v1.FirewallsClient:
+    return compute_v1.FirewallsClient()
+
+@functools.lru_cache(maxsize=None)
+def _zones_client() -> compute_v1.ZonesClient:
+    return compute_v1.ZonesClient()
+
+# ##################################
+# # Existing Resource Lookup     #
+# ##################################
+
+def lookup_existing_resources(project_id: str, region: str | None, address_name: str | None,
+                              firewall_rule_name: str | None) -> dict[str, compute_v1.Address | compute_v1.Firewall | None]:
+    """
+    Checks whether the static IP address and firewall rule already exist. Resources found in
+    the local state cache are not fetched at all; the rest are fetched with a single
+    Compute Engine batch HTTP request instead of one GET round-trip per resource.
+
+    Args:
+        project_id: The ID of the Google Cloud project.
+        region: The region of the static IP address. Only used if address_name is set.
+        address_name: The static IP address name to look up, or None to skip it.
+        firewall_rule_name: The firewall rule name to look up, or None to skip it.
+
+    Returns:
+        A dict with an "address" and/or "firewall" key. The value is the existing resource,
+        or None if it does not exist. A key is left out if its lookup failed, in which case
+        the caller should check for the resource itself.
+    """
+    results = {}
+    resource_types = {"address": compute_v1.Address, "firewall": compute_v1.Firewall}
+    lookups = {} # resource kind -> (scope, name)
+    if address_name:
+        lookups["address"] = (region, address_name)
+    if firewall_rule_name:
+        lookups["firewall"] = ("global", firewall_rule_name)
+
+    # Resources seen recently by this or a previous run need no GET at all
+    for resource_kind, (scope, name) in list(lookups.items()):
+        cached = get_cached_resource(project_id, scope, resource_kind, name)
+        if cached is not None:
+            print(f"INFO: Using cached state for existing {resource_kind} '{name}'.")
+            results[resource_kind] = resource_types[resource_kind].from_json(json.dumps(cached), ignore_unknown_fields=True)
+            del lookups[resource_kind]
+
+    def handle_response(request_id, response, exception):
+        scope, name = lookups[request_id]
+        if exception is None:
+            cache_resource(project_id, scope, request_id, name, response)
+            # Convert the discovery JSON into the same proto-plus types compute_v1 returns
+            results[request_id] = resource_types[request_id].from_json(json.dumps(response), ignore_unknown_fields=True)
+        elif isinstance(exception, HttpError) and exception.resp.status == 404:
+            invalidate_cached_resource(project_id, scope, request_id, name)
+            results[request_id] = None
+        else:
+            print(f"WARNING: Batched lookup of existing {request_id} failed: {exception}")
+
+    if not lookups:
+        return results
+
+    try:
+        service = discovery.build("compute", "v1", cache_discovery=False)
+        batch = service.new_batch_http_request(callback=handle_response)
+        if "address" in lookups:
+            batch.add(service.addresses().get(project=project_id, region=region, address=address_name), request_id="address")
+        if "firewall" in lookups:
+            batch.add(service.firewalls().get(project=project_id, firewall=firewall_rule_name), request_id="firewall")
+        batch.execute()
+    except Exception as e:
+        print(f"WARNING: Batched lookup of existing resources failed: {e}. Each step will check on its own.")
+    return results
+
 # ##################################
 # # Static IP Address Management #
 # ##################################
 
-def reserve_static_ip(project_id: str, region: str, address_name: str) -> compute_v1.Address | None:
+def reserve_static_ip(project_id: str, region: str, address_name: str,
+                      existing_address: compute_v1.Address | None = None,
+                      checked_existing: bool = False) -> compute_v1.Address | None:
     """
     Reserves a new static external IP address or gets an existing one.
 
@@ -16,49 +147,47 @@ def reserve_static_ip(project_id: str, region: str, address_name: str) -> comput
         project_id: The ID of the Google Cloud project.
         region: The region to reserve the IP address in (e.g., "us-west1").
         address_name: The desired name for the static IP address.
+        existing_address: The existing address, if the caller already looked it up.
+        checked_existing: True if the caller already looked the address up (existing_address
+            is then authoritative and no GET is issued here).
 
     Returns:
         The compute_v1.Address object if successful, None otherwise.
     """
-    address_client = compute_v1.AddressesClient()
+    address_client = _addresses_client()
     address_resource = compute_v1.Address(
         name=address_name,
         network_tier='STANDARD'  # Specify STANDARD tier for new reservations
     )
 
     try:
-        # Check if the address already exists
-        try:
-            existing_address = address_client.get(project=project_id, region=region, address=address_name)
+        # Check if the address already exists, unless the caller already looked it up
+        if not checked_existing:
+            try:
+                existing_address = address_client.get(project=project_id, region=region, address=address_name)
+            except NotFound:
+                existing_address = None
+            except Exception as e: # Catch other potential errors during get
+                print(f"WARNING: Error checking for existing IP address '{address_name}': {e}. Will attempt creation.")
+                existing_address = None
+
+        if existing_address is not None:
             print(f"INFO: Static IP address '{address_name}' already exists in region {region}: {existing_address.address}")
             return existing_address
-        except NotFound:
-            print(f"INFO: Static IP address '{address_name}' not found in region {region}. Attempting to create...")
-        except Exception as e: # Catch other potential errors during get
-            print(f"WARNING: Error checking for existing IP address '{address_name}': {e}. Will attempt creation.")
-
+        print(f"INFO: Static IP address '{address_name}' not found in region {region}. Attempting to create...")
 
         print(f"ACTION: Reserving static IP address '{address_name}' in project '{project_id}', region '{region}'...")
         operation = address_client.insert(project=project_id, region=region, address_resource=address_resource)
 
-        # Wait for the regional operation to complete
-        op_start_time = time.time()
-        region_operation_client = compute_v1.RegionOperationsClient()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5) # Increased sleep time
-            operation = region_operation_client.get(project=project_id, region=region, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for IP reservation operation to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-            if elapsed_time > 300: # 5 minutes timeout
-                print(f"ERROR: Timeout waiting for IP reservation operation for '{address_name}'.")
-                return None
-
-
-        if operation.error:
-            print(f"ERROR: Could not reserve static IP address '{address_name}'. Error: {operation.error.errors}")
+        # Wait for the regional operation to complete. The extended operation tracks its own scope.
+        if not _await_operation(operation, timeout_s=300, op_kind=f"IP reservation for '{address_name}'"):
+            invalidate_cached_resource(project_id, region, "address", address_name)
             return None
 
+        # The finished operation only carries a targetLink, not the allocated IP, so one GET is still needed.
+        # The result is cached below, so warm re-runs and later steps do not repeat it.
         reserved_address = address_client.get(project=project_id, region=region, address=address_name)
+        cache_resource(project_id, region, "address", address_name, json.loads(compute_v1.Address.to_json(reserved_address)))
         print(f"SUCCESS: Static IP address '{address_name}' reserved successfully: {reserved_address.address}")
         return reserved_address
     except Exception as e:
@@ -70,7 +199,9 @@ def reserve_static_ip(project_id: str, region: str, address_name: str) -> comput
 # ##################################
 
 def create_firewall_rule(project_id: str, firewall_rule_name: str, network_name: str,
-                         target_tag: str, allowed_ports: list[str]) -> bool:
+                         target_tag: str, allowed_ports: list[str],
+                         existing_firewall: compute_v1.Firewall | None = None,
+                         checked_existing: bool = False) -> bool:
     """
     Creates a new firewall rule or confirms if an existing one matches the configuration.
 
@@ -80,19 +211,23 @@ def create_firewall_rule(project_id: str, firewall_rule_name: str, network_name:
         network_name: The network URI (e.g., "global/networks/default").
         target_tag: The network tag the rule applies to.
         allowed_ports: A list of strings specifying protocols and ports (e.g., ["tcp:6697"]).
+        existing_firewall: The existing firewall rule, if the caller already looked it up.
+        checked_existing: True if the caller already looked the rule up (existing_firewall
+            is then authoritative and no GET is issued here).
 
     Returns:
         True if the rule is successfully created or already exists and matches, False otherwise.
     """
-    firewall_client = compute_v1.FirewallsClient()
+    firewall_client = _firewalls_client()
 
     # Define the 'allowed' part of the firewall rule
-    allowed_config = [
-        compute_v1.Allowed(
-            I_p_protocol=port_protocol.split(":")[0].lower(), # Ensure protocol is lowercase (tcp, udp, icmp, etc.)
-            ports=[port_protocol.split(":")[1]]
-        ) for port_protocol in allowed_ports
-    ]
+    allowed_config = []
+    for port_protocol in allowed_ports:
+        protocol, port = port_protocol.split(":", 1) # Split once; port ranges like "100-200" are kept intact
+        allowed_config.append(compute_v1.Allowed(
+            I_p_protocol=protocol.lower(), # Ensure protocol is lowercase (tcp, udp, icmp, etc.)
+            ports=[port]
+        ))
 
     firewall_resource = compute_v1.Firewall(
         name=firewall_rule_name,
@@ -102,47 +237,40 @@ def create_firewall_rule(project_id: str, firewall_rule_name: str, network_name:
         allowed=allowed_config,
         description="Firewall rule for ZNC bouncer access, created by deploy_znc.py script."
     )
+    requested_allowed = frozenset(allowed_ports) # Order-insensitive "protocol:port" set for the match check
 
     try:
-        # Check if the firewall rule already exists
-        try:
-            existing_firewall = firewall_client.get(project=project_id, firewall=firewall_rule_name)
-            if existing_firewall:
-                # Basic check: if it exists and applies to the same tag and ports (more complex checks can be added)
-                # This is a simplistic check. A robust check would compare all fields.
-                existing_allowed_simple = [f"{a.i_p_protocol}:{a.ports[0]}" for a in existing_firewall.allowed]
-                if existing_firewall.target_tags == [target_tag] and sorted(existing_allowed_simple) == sorted(allowed_ports):
-                    print(f"INFO: Firewall rule '{firewall_rule_name}' already exists and matches target tag and ports.")
-                    return True
-                else:
-                    print(f"WARNING: Firewall rule '{firewall_rule_name}' already exists but has different configuration. Manual review recommended.")
-                    # Not returning False, as it exists. User might need to delete/update it.
-                    return True # Or False, depending on desired behavior for mismatches
-        except NotFound:
-            print(f"INFO: Firewall rule '{firewall_rule_name}' not found. Attempting to create...")
-        except Exception as e:
-            print(f"WARNING: Error checking for existing firewall rule '{firewall_rule_name}': {e}. Will attempt creation.")
-
+        # Check if the firewall rule already exists, unless the caller already looked it up
+        if not checked_existing:
+            try:
+                existing_firewall = firewall_client.get(project=project_id, firewall=firewall_rule_name)
+            except NotFound:
+                existing_firewall = None
+            except Exception as e:
+                print(f"WARNING: Error checking for existing firewall rule '{firewall_rule_name}': {e}. Will attempt creation.")
+                existing_firewall = None
+
+        if existing_firewall is not None:
+            # Basic check: if it exists and applies to the same tag and ports (more complex checks can be added)
+            # This is a simplistic check. A robust check would compare all fields.
+            existing_allowed = frozenset(f"{a.I_p_protocol}:{a.ports[0]}" for a in existing_firewall.allowed)
+            if frozenset(existing_firewall.target_tags) == {target_tag} and existing_allowed == requested_allowed:
+                print(f"INFO: Firewall rule '{firewall_rule_name}' already exists and matches target tag and ports.")
+                return True
+            else:
+                print(f"WARNING: Firewall rule '{firewall_rule_name}' already exists but has different configuration. Manual review recommended.")
+                # Not returning False, as it exists. User might need to delete/update it.
+                return True # Or False, depending on desired behavior for mismatches
+        print(f"INFO: Firewall rule '{firewall_rule_name}' not found. Attempting to create...")
 
         print(f"ACTION: Creating firewall rule '{firewall_rule_name}' in project '{project_id}' for target tag '{target_tag}' on network '{network_name}' allowing ports {allowed_ports}...")
         operation = firewall_client.insert(project=project_id, firewall_resource=firewall_resource)
 
-        op_start_time = time.time()
-        global_operation_client = compute_v1.GlobalOperationsClient() # Use specific client for global ops
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5)
-            # For global operations, use the GlobalOperationsClient
-            operation = global_operation_client.get(project=project_id, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for firewall rule creation operation to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-            if elapsed_time > 300: # 5 minutes timeout
-                 print(f"ERROR: Timeout waiting for firewall rule creation for '{firewall_rule_name}'.")
-                 return False
-
-        if operation.error:
-            print(f"ERROR: Could not create firewall rule '{firewall_rule_name}'. Error: {operation.error.errors}")
+        if not _await_operation(operation, timeout_s=300, op_kind=f"firewall rule creation for '{firewall_rule_name}'"):
+            invalidate_cached_resource(project_id, "global", "firewall", firewall_rule_name)
             return False
 
+        cache_resource(project_id, "global", "firewall", firewall_rule_name, json.loads(compute_v1.Firewall.to_json(firewall_resource)))
         print(f"SUCCESS: Firewall rule '{firewall_rule_name}' created successfully.")
         return True
     except Exception as e:
@@ -153,11 +281,50 @@ def create_firewall_rule(project_id: str, firewall_rule_name: str, network_name:
 # # VM Instance Management       #
 # ##################################
 
-def create_vm_instance(project_id: str, zone: str, instance_name: str,
-                       machine_type: str, image_project: str, image_family: str,
-                       disk_size_gb: int, disk_type: str, assign_ephemeral_ip: bool = True,
+@dataclass(frozen=True, slots=True)
+class GcpUris:
+    """
+    Resource URIs for a deployment, formatted once instead of at each use.
+
+    Attributes:
+        machine_type: Machine type URI (e.g., "zones/us-west1-a/machineTypes/e2-micro").
+        source_image: Boot image family URI (e.g., "projects/debian-cloud/global/images/family/debian-11").
+        disk_type: Boot disk type URI (e.g., "zones/us-west1-a/diskTypes/pd-balanced").
+        network: Network URI for the VM and the firewall rule.
+    """
+    machine_type: str
+    source_image: str
+    disk_type: str
+    network: str = "global/networks/default" # Use the default VPC network
+
+    @classmethod
+    def for_deployment(cls, zone: str, machine_type: str, image_project: str,
+                       image_family: str, disk_type: str) -> "GcpUris":
+        """
+        Builds the URIs for a deployment from its short resource names.
+
+        Args:
+            zone: The zone the instance is created in (e.g., "us-west1-a").
+            machine_type: The machine type (e.g., "e2-micro").
+            image_project: The project ID for the boot image (e.g., "debian-cloud").
+            image_family: The image family for the boot image (e.g., "debian-11").
+            disk_type: The type of the boot disk (e.g., "pd-standard", "pd-balanced", "pd-ssd").
+
+        Returns:
+            The GcpUris for the deployment.
+        """
+        return cls(
+            machine_type=f"zones/{zone}/machineTypes/{machine_type}",
+            source_image=f"projects/{image_project}/global/images/family/{image_family}",
+            disk_type=f"zones/{zone}/diskTypes/{disk_type}",
+        )
+
+def create_vm_instance(project_id: str, zone: str, instance_name: str, uris: GcpUris,
+                       disk_size_gb: int, assign_ephemeral_ip: bool = True,
+                       static_ip_address: str | None = None,
                        tags: list[str] | None = None,
-                       startup_script_content: str | None = None) -> bool:
+                       startup_script_content: str | None = None,
+                       startup_script_url: str | None = None) -> bool:
     """
     Creates a new VM instance in the specified project and zone.
 
@@ -165,22 +332,19 @@ def create_vm_instance(project_id: str, zone: str, instance_name: str,
         project_id: The ID of the Google Cloud project.
         zone: The zone to create the instance in (e.g., "us-west1-a").
         instance_name: The name for the new VM instance.
-        machine_type: The machine type (e.g., "e2-micro").
-        image_project: The project ID for the boot image (e.g., "debian-cloud").
-        image_family: The image family for the boot image (e.g., "debian-11").
+        uris: Machine type, boot image, disk type and network URIs (see GcpUris.for_deployment).
         disk_size_gb: The size of the boot disk in GB.
-        disk_type: The type of the boot disk (e.g., "pd-standard", "pd-balanced", "pd-ssd").
-        assign_ephemeral_ip: If True, assigns an ephemeral public IP. Set to False if using a static IP.
+        assign_ephemeral_ip: If True, assigns an ephemeral public IP. Ignored if static_ip_address is set.
+        static_ip_address: A reserved static IP address to attach at creation time, so no
+            separate assignment operation is needed.
         tags: A list of network tags to apply to the instance.
         startup_script_content: String content of the startup script to be run on first boot.
+        startup_script_url: Cloud Storage URL of a startup script for the VM to fetch on boot.
 
     Returns:
         True if the instance is created successfully, False otherwise.
     """
-    instance_client = compute_v1.InstancesClient()
-
-    # Construct the machine type URI
-    machine_type_uri = f"zones/{zone}/machineTypes/{machine_type}"
+    instance_client = _instances_client()
 
     # Configure the boot disk
     boot_disk = compute_v1.AttachedDisk(
@@ -188,15 +352,24 @@ def create_vm_instance(project_id: str, zone: str, instance_name: str,
         auto_delete=True, # Delete the disk when the instance is deleted
         type_="PERSISTENT", # Changed to string representation
         initialize_params=compute_v1.AttachedDiskInitializeParams(
-            source_image=f"projects/{image_project}/global/images/family/{image_family}",
+            source_image=uris.source_image,
             disk_size_gb=disk_size_gb,
-            disk_type=f"zones/{zone}/diskTypes/{disk_type}",
+            disk_type=uris.disk_type,
         ),
     )
 
     # Configure the network interface
-    network_interface = compute_v1.NetworkInterface(name="global/networks/default") # Use the default VPC network
-    if assign_ephemeral_ip:
+    network_interface = compute_v1.NetworkInterface(network=uris.network)
+    if static_ip_address:
+        network_interface.access_configs = [
+            compute_v1.AccessConfig(
+                name="External NAT",
+                nat_i_p=static_ip_address,
+                network_tier="STANDARD", # Must match the reserved IP's tier
+                type_="ONE_TO_ONE_NAT"
+            )
+        ]
+    elif assign_ephemeral_ip:
         network_interface.access_configs = [
             compute_v1.AccessConfig(
                 name="External NAT", # Standard name for ephemeral IP config
@@ -204,13 +377,12 @@ def create_vm_instance(project_id: str, zone: str, instance_name: str,
                 type_="ONE_TO_ONE_NAT"
             )
         ]
-    # If not assigning ephemeral IP, access_configs list remains empty initially.
-    # It will be populated by assign_static_ip_to_vm if a static IP is used.
+    # Otherwise the VM has no external IP; assign_static_ip_to_vm can attach one later.
 
     # Prepare the instance resource
     instance_resource = compute_v1.Instance(
         name=instance_name,
-        machine_type=machine_type_uri,
+        machine_type=uris.machine_type,
         disks=[boot_disk],
         network_interfaces=[network_interface]
     )
@@ -219,38 +391,24 @@ def create_vm_instance(project_id: str, zone: str, instance_name: str,
     if tags:
         instance_resource.tags = compute_v1.Tags(items=tags)
 
-    # Add startup script if provided
+    # Add startup script if provided. A script URL is fetched by the VM itself, keeping it out of the insert request.
+    startup_metadata_items = []
     if startup_script_content:
-        if instance_resource.metadata is None:
-            instance_resource.metadata = compute_v1.Metadata()
-        if instance_resource.metadata.items is None: # Initialize items list if it's None
-            instance_resource.metadata.items = []
-        instance_resource.metadata.items.append(
-            compute_v1.Items(key="startup-script", value=startup_script_content)
-        )
+        startup_metadata_items.append(compute_v1.Items(key="startup-script", value=startup_script_content))
+    if startup_script_url:
+        startup_metadata_items.append(compute_v1.Items(key="startup-script-url", value=startup_script_url))
+    if startup_metadata_items:
+        instance_resource.metadata = compute_v1.Metadata(items=startup_metadata_items)
 
     try:
         print(f"ACTION: Creating instance '{instance_name}' in project '{project_id}', zone '{zone}'...")
-        print(f"  Config: MachineType='{machine_type}', Image='{image_project}/{image_family}', Disk='{disk_size_gb}GB {disk_type}'")
-        print(f"  Network: EphemeralIP='{assign_ephemeral_ip}', Tags='{tags if tags else 'None'}'")
-        print(f"  Metadata: StartupScript='{'Provided' if startup_script_content else 'None'}'")
+        print(f"  Config: MachineType='{uris.machine_type}', Image='{uris.source_image}', Disk='{disk_size_gb}GB {uris.disk_type}'")
+        print(f"  Network: StaticIP='{static_ip_address or 'None'}', EphemeralIP='{assign_ephemeral_ip and not static_ip_address}', Tags='{tags if tags else 'None'}'")
+        print(f"  Metadata: StartupScript='{'Provided' if startup_script_content else 'None'}', StartupScriptURL='{startup_script_url or 'None'}'")
 
         operation = instance_client.insert(project=project_id, zone=zone, instance_resource=instance_resource)
 
-        op_start_time = time.time()
-        zone_operation_client = compute_v1.ZoneOperationsClient()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5)
-            # Poll the zonal operation using ZoneOperationsClient
-            operation = zone_operation_client.get(project=project_id, zone=zone, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for instance creation operation to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-            if elapsed_time > 600: # 10 minutes timeout
-                 print(f"ERROR: Timeout waiting for instance creation for '{instance_name}'.")
-                 return False
-
-        if operation.error:
-            print(f"ERROR: Could not create instance '{instance_name}'. Error: {operation.error.errors}")
+        if not _await_operation(operation, timeout_s=600, op_kind=f"instance creation for '{instance_name}'"):
             return False
 
         print(f"SUCCESS: Instance '{instance_name}' created successfully.")
@@ -261,7 +419,8 @@ def create_vm_instance(project_id: str, zone: str, instance_name: str,
 
 def assign_static_ip_to_vm(project_id: str, zone: str, instance_name: str, ip_address: str, network_interface_name: str = "nic0") -> bool:
     """
-    Assigns a static external IP address to a VM instance's network interface.
+    Assigns a static external IP address to an existing VM instance's network interface.
+    New VMs get their static IP at creation time (see create_vm_instance).
 
     Args:
         project_id: The ID of the Google Cloud project.
@@ -273,7 +432,7 @@ def assign_static_ip_to_vm(project_id: str, zone: str, instance_name: str, ip_ad
     Returns:
         True if IP assignment was successful, False otherwise.
     """
-    instance_client = compute_v1.InstancesClient()
+    instance_client = _instances_client()
 
     try:
         print(f"ACTION: Assigning static IP {ip_address} to instance '{instance_name}' in zone '{zone}' (interface '{network_interface_name}')...")
@@ -302,20 +461,7 @@ def assign_static_ip_to_vm(project_id: str, zone: str, instance_name: str, ip_ad
             access_config_resource=new_access_config
         )
 
-        op_start_time = time.time()
-        # For zonal operations, use ZoneOperationsClient
-        zone_operation_client = compute_v1.ZoneOperationsClient()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5)
-            operation = zone_operation_client.get(project=project_id, zone=zone, operation=operation.name) # Poll zonal operation
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for IP assignment operation to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-            if elapsed_time > 300: # 5 minutes timeout
-                 print(f"ERROR: Timeout waiting for IP assignment for '{instance_name}'.")
-                 return False
-
-        if operation.error:
-            print(f"ERROR: Could not assign static IP to instance '{instance_name}'. Error: {operation.error.errors}")
+        if not _await_operation(operation, timeout_s=300, op_kind=f"IP assignment for '{instance_name}'"):
             return False
 
         print(f"SUCCESS: Static IP {ip_address} assigned successfully to instance '{instance_name}'.")
@@ -324,11 +470,55 @@ def assign_static_ip_to_vm(project_id: str, zone: str, instance_name: str, ip_ad
         print(f"ERROR: An unexpected error occurred while assigning static IP to instance '{instance_name}': {e}")
         return False
 
+# ##################################
+# # Startup Script Handling      #
+# ##################################
+
+MAX_METADATA_VALUE_BYTES = 256 * 1024 # Compute Engine limit for a single instance metadata value
+MMAP_THRESHOLD_BYTES = 64 * 1024 # Scripts larger than this are memory-mapped rather than read into a buffer
+
+def read_startup_script(startup_script_path: str) -> str | None:
+    """
+    Reads the startup script that will be passed to the VM as metadata.
+
+    Args:
+        startup_script_path: Path to the local startup script file.
+
+    Returns:
+        The script content, or None if the file is missing or unreadable.
+    """
+    try:
+        script_path = Path(startup_script_path)
+        script_size = script_path.stat().st_size
+        if script_size > MAX_METADATA_VALUE_BYTES:
+            print(f"WARNING: Startup script file '{startup_script_path}' exceeds the {MAX_METADATA_VALUE_BYTES // 1024} KB instance metadata limit. "
+                  "Upload it to Cloud Storage and pass --startup-script-url instead. Proceeding without a startup script.")
+            return None
+        if script_size > MMAP_THRESHOLD_BYTES:
+            # Decode straight from the page cache; the proto field only accepts str, so one decode is unavoidable
+            with open(script_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_script:
+                startup_script_content = str(mapped_script, "utf-8")
+        else:
+            startup_script_content = script_path.read_text(encoding="utf-8")
+        print(f"INFO: Successfully read startup script from '{startup_script_path}'.")
+        return startup_script_content
+    except FileNotFoundError:
+        print(f"WARNING: Startup script file '{startup_script_path}' not found. Proceeding without a startup script.")
+    except Exception as e:
+        print(f"WARNING: Error reading startup script file '{startup_script_path}': {e}. Proceeding without a startup script.")
+    return None
+
 # ##################################
 # # Main Execution Block         #
 # ##################################
 
-if __name__ == "__main__":
+def main(argv: list[str] | None = None) -> None:
+    """
+    Runs the deployment end to end.
+
+    Args:
+        argv: Command-line arguments to parse instead of sys.argv[1:].
+    """
     parser = argparse.ArgumentParser(
         description="Deploy a ZNC VM on Google Cloud with static IP and firewall configuration.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter # Shows default values in help
@@ -349,6 +539,7 @@ if __name__ == "__main__":
     vm_group.add_argument("--disk-size-gb", type=int, default=10, help="Boot disk size in GB.")
     vm_group.add_argument("--disk-type", default="pd-balanced", help="Boot disk type (e.g., pd-standard, pd-balanced, pd-ssd).")
     vm_group.add_argument("--startup-script-path", default="startup-script.sh", help="Path to the local startup script file to be executed on VM boot.")
+    vm_group.add_argument("--startup-script-url", help="Cloud Storage URL (gs://...) of a startup script for the VM to fetch on boot. Use this for scripts larger than the 256 KB metadata limit; takes precedence over --startup-script-path.")
 
     # --- Networking Configuration ---
     network_group = parser.add_argument_group("Networking Configuration")
@@ -360,120 +551,141 @@ if __name__ == "__main__":
     firewall_group.add_argument("--firewall-rule-name", default="allow-znc-access", help="Name for the firewall rule to allow ZNC traffic.")
     firewall_group.add_argument("--znc-port", type=int, default=6697, help="Port number ZNC will listen on (this port will be opened in the firewall).")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Critical: Check for placeholder project ID
     if args.project_id == "your-gcp-project-id-here" or not args.project_id:
         print("CRITICAL ERROR: Please provide your Google Cloud Project ID using the --project-id argument.")
         sys.exit(1) # Use sys.exit for cleaner exit with error code
 
+    # Resolve credentials and reach the Compute API with a cheap read before creating anything,
+    # so a misconfigured ADC setup or a bad project/zone fails here rather than mid-deployment.
+    try:
+        _zones_client().get(project=args.project_id, zone=args.zone)
+    except Exception as e:
+        print(f"CRITICAL ERROR: Could not access zone '{args.zone}' in project '{args.project_id}': {e}")
+        print("Check your Application Default Credentials (`gcloud auth application-default login`), the project ID and the zone.")
+        sys.exit(1)
+
     # Determine region for static IP if not explicitly provided
     actual_region = args.region if args.region else args.zone.rsplit('-', 1)[0]
 
-    # Read startup script content from the specified file path
-    startup_script_content_main = None
-    if args.startup_script_path:
-        try:
-            with open(args.startup_script_path, "r") as f:
-                startup_script_content_main = f.read()
-            print(f"INFO: Successfully read startup script from '{args.startup_script_path}'.")
-        except FileNotFoundError:
-            print(f"WARNING: Startup script file '{args.startup_script_path}' not found. Proceeding without a startup script.")
-        except Exception as e:
-            print(f"WARNING: Error reading startup script file '{args.startup_script_path}': {e}. Proceeding without a startup script.")
+    gcp_uris = GcpUris.for_deployment(
+        zone=args.zone,
+        machine_type=args.machine_type,
+        image_project=args.image_project,
+        image_family=args.image_family,
+        disk_type=args.disk_type
+    )
 
     # Initialize state variables
     vm_created_successfully = False
     static_ip_address_value = None # Store the actual IP address string if reserved/fetched
     reserved_ip_info = None # Store the Address object
+    firewall_success = False
 
-    # --- Step 1: Reserve Static IP (if requested) ---
-    if args.static_ip_name:
-        print(f"\n--- Attempting to reserve/get static IP '{args.static_ip_name}' in region '{actual_region}' ---")
-        reserved_ip_info = reserve_static_ip(args.project_id, actual_region, args.static_ip_name)
-        if reserved_ip_info and reserved_ip_info.address:
-            static_ip_address_value = reserved_ip_info.address
-            print(f"INFO: Static IP '{reserved_ip_info.name}' is available at {static_ip_address_value}.")
-        else:
-            print(f"CRITICAL ERROR: Could not reserve or find static IP '{args.static_ip_name}'. Halting deployment.")
-            sys.exit(1)
-    else:
-        print("\n--- Proceeding with an ephemeral IP address for the VM (no static IP name provided) ---")
-
-    # --- Step 2: Create VM Instance ---
-    print(f"\n--- Attempting to create VM instance '{args.instance_name}' ---")
-    vm_tags = [args.network_tag] if args.network_tag else [] # Ensure tags is a list
+    firewall_requested = bool(args.network_tag and args.firewall_rule_name and args.znc_port)
 
-    vm_created_successfully = create_vm_instance(
+    # Look up the static IP and firewall rule together so the steps below skip their own GETs
+    existing_resources = lookup_existing_resources(
         project_id=args.project_id,
-        zone=args.zone,
-        instance_name=args.instance_name,
-        machine_type=args.machine_type,
-        image_project=args.image_project,
-        image_family=args.image_family,
-        disk_size_gb=args.disk_size_gb,
-        disk_type=args.disk_type,
-        assign_ephemeral_ip=(not args.static_ip_name), # Assign ephemeral only if not using static IP
-        tags=vm_tags,
-        startup_script_content=startup_script_content_main
+        region=actual_region,
+        address_name=args.static_ip_name,
+        firewall_rule_name=args.firewall_rule_name if firewall_requested else None
     )
 
-    if not vm_created_successfully:
-        print(f"CRITICAL ERROR: VM instance '{args.instance_name}' creation failed. Halting deployment.")
-        # Note: If static IP was reserved but VM creation failed, the IP remains reserved.
-        # Consider adding logic to release the IP here if that's the desired behavior.
-        sys.exit(1)
+    # Steps with no data dependency on each other (startup script read, IP reservation,
+    # firewall rule) are started together; results are collected only where a later step needs them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        startup_script_future = None
+        if args.startup_script_path and not args.startup_script_url:
+            startup_script_future = executor.submit(read_startup_script, args.startup_script_path)
 
-    # --- Step 3: Assign Static IP to VM (if static IP was used and VM created) ---
-    # This step is only needed if we created the VM without an IP initially,
-    # and now need to assign the reserved static IP.
-    # The current create_vm_instance logic with assign_ephemeral_ip=False handles this by not adding any AccessConfig.
-    # So, assign_static_ip_to_vm is crucial here.
-    if args.static_ip_name and static_ip_address_value and vm_created_successfully:
-        print(f"\n--- Attempting to assign static IP '{static_ip_address_value}' to VM '{args.instance_name}' ---")
-        assign_success = assign_static_ip_to_vm(
-            project_id=args.project_id,
-            zone=args.zone,
-            instance_name=args.instance_name,
-            ip_address=static_ip_address_value
-        )
-        if not assign_success:
-            print(f"ERROR: Failed to assign static IP to VM '{args.instance_name}'. The VM is created but may not have the desired external IP. Manual intervention might be needed.")
-            # Don't halt here, firewall might still be useful, or user can fix IP manually.
+        # --- Step 1: Reserve Static IP (if requested) ---
+        static_ip_future = None
+        if args.static_ip_name:
+            print(f"\n--- Attempting to reserve/get static IP '{args.static_ip_name}' in region '{actual_region}' ---")
+            static_ip_future = executor.submit(
+                reserve_static_ip,
+                args.project_id,
+                actual_region,
+                args.static_ip_name,
+                existing_address=existing_resources.get("address"),
+                checked_existing="address" in existing_resources
+            )
+        else:
+            print("\n--- Proceeding with an ephemeral IP address for the VM (no static IP name provided) ---")
 
-    # --- Step 4: Create Firewall Rule (if VM created successfully) ---
-    if vm_created_successfully:
-        if args.network_tag and args.firewall_rule_name and args.znc_port:
+        # --- Step 3 (started early): Create Firewall Rule ---
+        # The rule only needs the project, tag and port, so it does not wait for the VM.
+        firewall_future = None
+        if firewall_requested:
             print(f"\n--- Attempting to create firewall rule '{args.firewall_rule_name}' ---")
             firewall_ports_to_allow = [f"tcp:{args.znc_port}"]
-            network_uri = "global/networks/default" # Assuming default network
 
-            firewall_success = create_firewall_rule(
+            firewall_future = executor.submit(
+                create_firewall_rule,
                 project_id=args.project_id,
                 firewall_rule_name=args.firewall_rule_name,
-                network_name=network_uri,
+                network_name=gcp_uris.network,
                 target_tag=args.network_tag,
-                allowed_ports=firewall_ports_to_allow
+                allowed_ports=firewall_ports_to_allow,
+                existing_firewall=existing_resources.get("firewall"),
+                checked_existing="firewall" in existing_resources
             )
+        elif args.network_tag or args.firewall_rule_name or args.znc_port: # If some firewall args are present but not all
+             print("\nWARNING: Firewall rule creation was skipped because one or more of --network-tag, --firewall-rule-name, or --znc-port were not specified. All are required for firewall setup.")
+
+        startup_script_content_main = startup_script_future.result() if startup_script_future else None
+
+        if static_ip_future:
+            reserved_ip_info = static_ip_future.result()
+            if reserved_ip_info and reserved_ip_info.address:
+                static_ip_address_value = reserved_ip_info.address
+                print(f"INFO: Static IP '{reserved_ip_info.name}' is available at {static_ip_address_value}.")
+            else:
+                print(f"CRITICAL ERROR: Could not reserve or find static IP '{args.static_ip_name}'. Halting deployment.")
+                sys.exit(1) # Leaving the executor block still waits for an in-flight firewall rule
+
+        # --- Step 2: Create VM Instance ---
+        print(f"\n--- Attempting to create VM instance '{args.instance_name}' ---")
+        vm_tags = [args.network_tag] if args.network_tag else [] # Ensure tags is a list
+
+        vm_created_successfully = create_vm_instance(
+            project_id=args.project_id,
+            zone=args.zone,
+            instance_name=args.instance_name,
+            uris=gcp_uris,
+            disk_size_gb=args.disk_size_gb,
+            assign_ephemeral_ip=(not args.static_ip_name), # Assign ephemeral only if not using static IP
+            static_ip_address=static_ip_address_value, # Attached at insert time, no separate assignment step
+            tags=vm_tags,
+            startup_script_content=startup_script_content_main,
+            startup_script_url=args.startup_script_url
+        )
+
+        if not vm_created_successfully:
+            print(f"CRITICAL ERROR: VM instance '{args.instance_name}' creation failed. Halting deployment.")
+            if static_ip_address_value:
+                # The address may have come from the cache and been released since; look it up again next run
+                invalidate_cached_resource(args.project_id, actual_region, "address", args.static_ip_name)
+            # Note: If static IP was reserved but VM creation failed, the IP remains reserved.
+            # Consider adding logic to release the IP here if that's the desired behavior.
+            sys.exit(1)
+
+        if firewall_future:
+            firewall_success = firewall_future.result()
             if firewall_success:
                 print(f"INFO: Firewall rule '{args.firewall_rule_name}' is configured for tag '{args.network_tag}' on port {args.znc_port}.")
             else:
                 print(f"ERROR: Firewall rule '{args.firewall_rule_name}' configuration failed. Please check logs and configure manually if needed.")
-        elif args.network_tag or args.firewall_rule_name or args.znc_port: # If some firewall args are present but not all
-             print("\nWARNING: Firewall rule creation was skipped because one or more of --network-tag, --firewall-rule-name, or --znc-port were not specified. All are required for firewall setup.")
-
 
     # --- Final Summary ---
     print(f"\n--- ZNC VM Deployment Summary for Instance '{args.instance_name}' ---")
     if vm_created_successfully:
         print(f"  VM Status: Successfully deployed.")
-        if args.static_ip_name:
-            if static_ip_address_value and assign_success: # Check if assignment was attempted and successful
-                 print(f"  IP Address: Configured with Static IP '{static_ip_address_value}' (Name: {args.static_ip_name}).")
-            elif static_ip_address_value: # IP reserved but assignment failed
-                 print(f"  IP Address: Attempted Static IP '{static_ip_address_value}' (Name: {args.static_ip_name}) - ASSIGNMENT FAILED. Check logs.")
-            else: # Should not happen if static_ip_name is set and reservation succeeded.
-                 print(f"  IP Address: Static IP '{args.static_ip_name}' was intended but value is missing.")
+        if args.static_ip_name: # Deployment halts earlier if the static IP could not be reserved
+            print(f"  IP Address: Configured with Static IP '{static_ip_address_value}' (Name: {args.static_ip_name}).")
         else:
             print(f"  IP Address: Configured with an Ephemeral IP. Check Google Cloud Console for the address.")
 
@@ -484,7 +696,9 @@ if __name__ == "__main__":
         else:
             print(f"  Firewall: No specific firewall rule was configured by this script for ZNC port (or arguments missing).")
 
-        if startup_script_content_main:
+        if args.startup_script_url:
+            print(f"  Startup Script: VM fetches it from '{args.startup_script_url}'. Check VM logs for execution details (/var/log/startup-script.log).")
+        elif startup_script_content_main:
             print(f"  Startup Script: Was provided from '{args.startup_script_path}'. Check VM logs for execution details (/var/log/startup-script.log).")
         else:
             print(f"  Startup Script: Not provided or file not found at '{args.startup_script_path}'.")
@@ -499,3 +713,7 @@ if __name__ == "__main__":
         print(f"  VM Status: Deployment FAILED. See error messages above.")
 
     print("--- End of Deployment ---")
+
+
+if __name__ == "__main__":
+    main()
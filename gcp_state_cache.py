@@ -0,0 +1,99 @@
+"""
+Local cache of GCP resource state, shared by deploy_znc.py and undeploy_znc.py.
+
+Re-running the deployment while iterating on a setup is common. Remembering the static IP
+address and firewall rule that were last seen lets warm runs skip their existence-check
+GETs. Entries expire after CACHE_TTL_SECONDS and are dropped whenever an operation on the
+resource fails or the resource is deleted.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+CACHE_PATH = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "zncgpc" / "gcp_state.json"
+CACHE_TTL_SECONDS = 3600 # 1 hour
+
+_cache_lock = threading.Lock() # Deploy steps run on worker threads and may write concurrently
+
+
+def _cache_key(project_id: str, scope: str, resource_kind: str, name: str) -> str:
+    return f"{project_id}/{scope}/{resource_kind}/{name}"
+
+
+def _load_entries() -> dict:
+    try:
+        with open(CACHE_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError): # Missing or corrupt cache is treated as empty
+        return {}
+
+
+def _save_entries(entries: dict) -> None:
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # A temp file unique to this write, in the same directory so os.replace stays on one filesystem
+        with tempfile.NamedTemporaryFile("w", dir=CACHE_PATH.parent, prefix=".gcp_state.", suffix=".tmp", delete=False) as tmp_file:
+            tmp_file.write(json.dumps(entries))
+        try:
+            os.replace(tmp_file.name, CACHE_PATH) # Atomic, so concurrent script runs never see a partial file
+        except OSError:
+            os.unlink(tmp_file.name)
+            raise
+    except OSError as e:
+        print(f"WARNING: Could not write GCP state cache '{CACHE_PATH}': {e}")
+
+
+def get_cached_resource(project_id: str, scope: str, resource_kind: str, name: str) -> dict | None:
+    """
+    Returns the cached JSON representation of a resource.
+
+    Args:
+        project_id: The ID of the Google Cloud project.
+        scope: The region of a regional resource, or "global".
+        resource_kind: The kind of resource (e.g., "address", "firewall").
+        name: The resource name.
+
+    Returns:
+        The cached resource as a dict, or None if it is not cached or the entry has expired.
+    """
+    with _cache_lock:
+        entry = _load_entries().get(_cache_key(project_id, scope, resource_kind, name))
+    if entry is None or time.time() - entry["cached_at"] > CACHE_TTL_SECONDS:
+        return None
+    return entry["resource"]
+
+
+def cache_resource(project_id: str, scope: str, resource_kind: str, name: str, resource: dict) -> None:
+    """
+    Stores the JSON representation of a resource that is known to exist.
+
+    Args:
+        project_id: The ID of the Google Cloud project.
+        scope: The region of a regional resource, or "global".
+        resource_kind: The kind of resource (e.g., "address", "firewall").
+        name: The resource name.
+        resource: The resource as a JSON-compatible dict.
+    """
+    with _cache_lock:
+        entries = _load_entries()
+        entries[_cache_key(project_id, scope, resource_kind, name)] = {"cached_at": time.time(), "resource": resource}
+        _save_entries(entries)
+
+
+def invalidate_cached_resource(project_id: str, scope: str, resource_kind: str, name: str) -> None:
+    """
+    Drops a resource from the cache, e.g. after it was deleted or an operation on it failed.
+
+    Args:
+        project_id: The ID of the Google Cloud project.
+        scope: The region of a regional resource, or "global".
+        resource_kind: The kind of resource (e.g., "address", "firewall").
+        name: The resource name.
+    """
+    with _cache_lock:
+        entries = _load_entries()
+        if entries.pop(_cache_key(project_id, scope, resource_kind, name), None) is not None:
+            _save_entries(entries)
@@ -1,10 +1,71 @@
 import argparse
+import concurrent.futures
+import contextlib
+import functools
+import json
+import logging
 import sys
-import time # Will be needed for waiting on operations
+from dataclasses import asdict, dataclass
 from google.cloud import compute_v1
-from google.api_core.exceptions import NotFound # For checking if a resource exists before deletion
+from google.api_core.exceptions import DeadlineExceeded, GoogleAPICallError, NotFound, ResourceExhausted, ServiceUnavailable
+from google.api_core import retry
+from google.api_core.future import polling
+from gcp_state_cache import invalidate_cached_resource
+
+logger = logging.getLogger("undeploy_znc")
+
+# api-core samples each polling delay uniformly from [0, cap]. The cap starts at 0.5s and doubles
+# up to 10s, so fast deletions (firewall rules often finish in under a second) are seen quickly,
+# while a long wait averages one operation GET every 5s, no more than a fixed 5s poll would issue.
+OPERATION_POLLING = polling.DEFAULT_POLLING.with_delay(initial=0.5, maximum=10.0, multiplier=2.0)
+
+# The Compute API returns these under load; they are retried instead of failing the whole run, for up
+# to 120s. api-core draws each retry delay uniformly from [0, cap], where the cap starts at 1s and
+# doubles up to 30s, so early retries may follow almost immediately. It covers the DELETE call, which
+# is idempotent and so safe to resend, and each operation-status GET made while waiting for it to finish.
+# NotFound is not retried: it means the resource is already gone and is handled as success.
+DELETE_RETRY = retry.Retry(
+    predicate=retry.if_exception_type(ServiceUnavailable, DeadlineExceeded, ResourceExhausted),
+    initial=1.0,
+    maximum=30.0,
+    multiplier=2.0,
+    timeout=120.0
+)
+
+# Each client is built once per process and shared by the deletion workers,
+# so credentials and the connection pool are set up once rather than per call.
+
+@functools.lru_cache(maxsize=None)
+def _instances_client() -> compute_v1.InstancesClient:
+    return compute_v1.InstancesClient()
+
+@functools.lru_cache(maxsize=None)
+def _addresses_client() -> compute_v1.AddressesClient:
+    return compute_v1.AddressesClient()
+
+@functools.lru_cache(maxsize=None)
+def _firewalls_client() -> compute_v1.FirewallsClient:
+    return compute_v1.FirewallsClient()
+
+@dataclass(frozen=True, slots=True)
+class DeleteResult:
+    """
+    Outcome of one resource deletion, as reported in the final summary.
 
-# Placeholder/Stub functions for deletion operations
+    Attributes:
+        resource: Kind of resource (e.g., "VM Instance").
+        name: Resource name, or "" if none was provided.
+        status: "DELETED", "FAILED" or "SKIPPED".
+        detail: Extra context for the summary line (e.g., the region of a static IP).
+    """
+    resource: str
+    name: str
+    status: str
+    detail: str = ""
+
+# Deletion helpers. Each one issues its DELETE directly and treats NotFound as "already deleted",
+# whether it is raised by the DELETE call or reported by the finished operation. Do not add a
+# .get() existence check first: it would double the API requests without changing the outcome.
 def delete_vm_instance(project_id: str, zone: str, instance_name: str) -> bool:
     """
     Deletes a VM instance from the specified project and zone.
@@ -16,49 +77,46 @@ def delete_vm_instance(project_id: str, zone: str, instance_name: str) -> bool:
 
     Returns:
         True if deletion was successful or instance was not found, False otherwise.
+
+    Note:
+        Do not call .get() first; the DELETE itself is idempotent via NotFound.
     """
-    instance_client = compute_v1.InstancesClient()
-    zone_operation_client = compute_v1.ZoneOperationsClient()
+    instance_client = _instances_client()
 
     try:
-        print(f"ACTION: Deleting instance '{instance_name}' in project '{project_id}', zone '{zone}'...")
+        logger.info("Deleting instance '%s' in project '%s', zone '%s'...", instance_name, project_id, zone)
         operation = instance_client.delete(
             project=project_id,
             zone=zone,
-            instance=instance_name
+            instance=instance_name,
+            retry=DELETE_RETRY
         )
 
-        # Wait for the operation to complete
-        op_start_time = time.time()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5) # Poll every 5 seconds
-            operation = zone_operation_client.get(project=project_id, zone=zone, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for instance deletion operation for '{instance_name}' to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-
-            if elapsed_time > 600: # 10 minutes timeout
-                print(f"ERROR: Timeout waiting for instance '{instance_name}' deletion after {elapsed_time:.0f} seconds.")
-                # Check operation status one last time or handle as per policy
-                if operation.error:
-                     print(f"ERROR details (timeout): {operation.error.errors}")
-                return False
-
-        if operation.error:
-            print(f"ERROR: Could not delete instance '{instance_name}'. Error details: {operation.error.errors}")
+        # Wait for the operation to complete. The extended operation polls its own zonal scope.
+        logger.debug("Waiting for instance deletion operation for '%s' to complete...", instance_name)
+        try:
+            operation.result(timeout=600, retry=DELETE_RETRY, polling=OPERATION_POLLING) # 10 minutes timeout
+        except concurrent.futures.TimeoutError:
+            logger.error("Timeout waiting for instance '%s' deletion after 600 seconds.", instance_name)
+            return False
+        except NotFound:
+            raise # Instance vanished before the operation finished; handled below as already deleted
+        except GoogleAPICallError as e: # Raised when the operation finishes with an error
+            logger.error("Could not delete instance '%s'. Error details: %s", instance_name, e)
             # Check for specific errors, e.g. if it's due to resource being in use by another operation
             for error_detail in operation.error.errors:
                 if error_detail.code == 'RESOURCE_IN_USE_BY_ANOTHER_RESOURCE':
-                    print("INFO: Instance might be in use or has dependent resources (like attached disks set to not auto-delete).")
+                    logger.info("Instance might be in use or has dependent resources (like attached disks set to not auto-delete).")
             return False
 
-        print(f"SUCCESS: Instance '{instance_name}' deleted successfully from zone '{zone}'.")
+        logger.info("Instance '%s' deleted successfully from zone '%s'.", instance_name, zone)
         return True
 
     except NotFound:
-        print(f"INFO: Instance '{instance_name}' not found in project '{project_id}', zone '{zone}'. Considered deleted.")
+        logger.info("Instance '%s' not found in project '%s', zone '%s'. Considered deleted.", instance_name, project_id, zone)
         return True
-    except Exception as e:
-        print(f"ERROR: An unexpected error occurred while deleting instance '{instance_name}': {e}")
+    except Exception as e: # Includes transient errors that persisted through DELETE_RETRY
+        logger.error("An unexpected error occurred while deleting instance '%s': %s", instance_name, e)
         return False
 
 def delete_static_ip(project_id: str, region: str, static_ip_name: str) -> bool:
@@ -72,44 +130,44 @@ def delete_static_ip(project_id: str, region: str, static_ip_name: str) -> bool:
 
     Returns:
         True if deletion was successful or the address was not found, False otherwise.
+
+    Note:
+        Do not call .get() first; the DELETE itself is idempotent via NotFound.
     """
-    address_client = compute_v1.AddressesClient()
-    region_operation_client = compute_v1.RegionOperationsClient()
+    address_client = _addresses_client()
 
     try:
-        print(f"ACTION: Deleting static IP address '{static_ip_name}' in project '{project_id}', region '{region}'...")
+        logger.info("Deleting static IP address '%s' in project '%s', region '%s'...", static_ip_name, project_id, region)
         operation = address_client.delete(
             project=project_id,
             region=region,
-            address=static_ip_name
+            address=static_ip_name,
+            retry=DELETE_RETRY
         )
 
         # Wait for the regional operation to complete
-        op_start_time = time.time()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5) # Poll every 5 seconds
-            operation = region_operation_client.get(project=project_id, region=region, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for static IP deletion operation for '{static_ip_name}' to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-
-            if elapsed_time > 300: # 5 minutes timeout
-                print(f"ERROR: Timeout waiting for static IP '{static_ip_name}' deletion after {elapsed_time:.0f} seconds.")
-                if operation.error: # Log error details if available on timeout
-                     print(f"ERROR details (timeout): {operation.error.errors}")
-                return False
-
-        if operation.error:
-            print(f"ERROR: Could not delete static IP '{static_ip_name}'. Error details: {operation.error.errors}")
+        logger.debug("Waiting for static IP deletion operation for '%s' to complete...", static_ip_name)
+        try:
+            operation.result(timeout=300, retry=DELETE_RETRY, polling=OPERATION_POLLING) # 5 minutes timeout
+        except concurrent.futures.TimeoutError:
+            logger.error("Timeout waiting for static IP '%s' deletion after 300 seconds.", static_ip_name)
+            return False
+        except NotFound:
+            raise
+        except GoogleAPICallError as e:
+            logger.error("Could not delete static IP '%s'. Error details: %s", static_ip_name, e)
             return False
 
-        print(f"SUCCESS: Static IP address '{static_ip_name}' deleted successfully from region '{region}'.")
+        logger.info("Static IP address '%s' deleted successfully from region '%s'.", static_ip_name, region)
+        invalidate_cached_resource(project_id, region, "address", static_ip_name) # Keep deploy_znc.py from reusing it
         return True
 
     except NotFound:
-        print(f"INFO: Static IP address '{static_ip_name}' not found in project '{project_id}', region '{region}'. Considered deleted.")
+        logger.info("Static IP address '%s' not found in project '%s', region '%s'. Considered deleted.", static_ip_name, project_id, region)
+        invalidate_cached_resource(project_id, region, "address", static_ip_name)
         return True
-    except Exception as e:
-        print(f"ERROR: An unexpected error occurred while deleting static IP '{static_ip_name}': {e}")
+    except Exception as e: # Includes transient errors that persisted through DELETE_RETRY
+        logger.error("An unexpected error occurred while deleting static IP '%s': %s", static_ip_name, e)
         return False
 
 def delete_firewall_rule(project_id: str, firewall_rule_name: str) -> bool:
@@ -122,107 +180,97 @@ def delete_firewall_rule(project_id: str, firewall_rule_name: str) -> bool:
 
     Returns:
         True if deletion was successful or the rule was not found, False otherwise.
+
+    Note:
+        Do not call .get() first; the DELETE itself is idempotent via NotFound.
     """
-    firewall_client = compute_v1.FirewallsClient()
-    global_operation_client = compute_v1.GlobalOperationsClient()
+    firewall_client = _firewalls_client()
 
     try:
-        print(f"ACTION: Deleting firewall rule '{firewall_rule_name}' in project '{project_id}'...")
+        logger.info("Deleting firewall rule '%s' in project '%s'...", firewall_rule_name, project_id)
         operation = firewall_client.delete(
             project=project_id,
-            firewall=firewall_rule_name
+            firewall=firewall_rule_name,
+            retry=DELETE_RETRY
         )
 
         # Wait for the global operation to complete
-        op_start_time = time.time()
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5) # Poll every 5 seconds
-            operation = global_operation_client.get(project=project_id, operation=operation.name)
-            elapsed_time = time.time() - op_start_time
-            print(f"INFO: Waiting for firewall rule deletion operation for '{firewall_rule_name}' to complete... Status: {operation.status.name} (Elapsed: {elapsed_time:.0f}s)")
-
-            if elapsed_time > 300: # 5 minutes timeout
-                print(f"ERROR: Timeout waiting for firewall rule '{firewall_rule_name}' deletion after {elapsed_time:.0f} seconds.")
-                if operation.error: # Log error details if available on timeout
-                     print(f"ERROR details (timeout): {operation.error.errors}")
-                return False
-
-        if operation.error:
-            print(f"ERROR: Could not delete firewall rule '{firewall_rule_name}'. Error details: {operation.error.errors}")
+        logger.debug("Waiting for firewall rule deletion operation for '%s' to complete...", firewall_rule_name)
+        try:
+            operation.result(timeout=300, retry=DELETE_RETRY, polling=OPERATION_POLLING) # 5 minutes timeout
+        except concurrent.futures.TimeoutError:
+            logger.error("Timeout waiting for firewall rule '%s' deletion after 300 seconds.", firewall_rule_name)
+            return False
+        except NotFound:
+            raise
+        except GoogleAPICallError as e:
+            logger.error("Could not delete firewall rule '%s'. Error details: %s", firewall_rule_name, e)
             return False
 
-        print(f"SUCCESS: Firewall rule '{firewall_rule_name}' deleted successfully from project '{project_id}'.")
+        logger.info("Firewall rule '%s' deleted successfully from project '%s'.", firewall_rule_name, project_id)
+        invalidate_cached_resource(project_id, "global", "firewall", firewall_rule_name)
         return True
 
     except NotFound:
-        print(f"INFO: Firewall rule '{firewall_rule_name}' not found in project '{project_id}'. Considered deleted.")
+        logger.info("Firewall rule '%s' not found in project '%s'. Considered deleted.", firewall_rule_name, project_id)
+        invalidate_cached_resource(project_id, "global", "firewall", firewall_rule_name)
         return True
-    except Exception as e:
-        print(f"ERROR: An unexpected error occurred while deleting firewall rule '{firewall_rule_name}': {e}")
+    except Exception as e: # Includes transient errors that persisted through DELETE_RETRY
+        logger.error("An unexpected error occurred while deleting firewall rule '%s': %s", firewall_rule_name, e)
         return False
 
+def _delete_static_ip_after_vm(vm_deletion: concurrent.futures.Future, project_id: str, region: str, static_ip_name: str) -> bool:
+    """
+    Deletes a static IP address once the VM deletion it depends on has finished.
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Undeploy ZNC VM and associated resources from Google Cloud.",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter
-    )
-
-    # --- Required Arguments ---
-    req_group = parser.add_argument_group("Required Arguments")
-    req_group.add_argument("--project-id", required=True, help="Google Cloud Project ID.")
-    req_group.add_argument("--zone", required=True, help="Compute zone of the VM instance (e.g., us-central1-c).")
+    Compute rejects deleting an address that is still attached to an instance
+    (resourceInUseByAnotherResource), so the address goes only after the VM.
+    Like the sequential flow, it is attempted even if the VM deletion failed.
 
-    # --- VM Deletion Arguments ---
-    vm_group = parser.add_argument_group("VM Deletion")
-    vm_group.add_argument("--instance-name", default="znc-bouncer-vm", help="Name of the VM instance to delete.")
+    Args:
+        vm_deletion: The future of the delete_vm_instance call.
+        project_id: The ID of the Google Cloud project.
+        region: The region where the static IP address exists.
+        static_ip_name: The name of the static IP address to delete.
 
-    # --- Static IP Deletion Arguments ---
-    ip_group = parser.add_argument_group("Static IP Deletion")
-    ip_group.add_argument("--static-ip-name", help="Name of the static IP address to delete. If not provided, static IP deletion will be skipped.")
-    ip_group.add_argument("--region", help="Region of the static IP address. Required if --static-ip-name is provided; can be derived from --zone if not set.")
+    Returns:
+        The result of delete_static_ip.
+    """
+    vm_deletion.result()
+    return delete_static_ip(project_id, region, static_ip_name)
 
-    # --- Firewall Deletion Arguments ---
-    fw_group = parser.add_argument_group("Firewall Deletion")
-    fw_group.add_argument("--firewall-rule-name", default="allow-znc-access", help="Name of the firewall rule to delete.")
 
-    # --- Control Arguments ---
-    control_group = parser.add_argument_group("Control Arguments")
-    control_group.add_argument("--yes", action='store_true', default=False, help="Bypass interactive confirmation for deletions.")
+def _run_undeploy(args: argparse.Namespace) -> list[DeleteResult]:
+    """
+    Shows the plan, asks for confirmation and deletes the resources.
 
-    args = parser.parse_args()
+    Args:
+        args: The parsed command-line arguments.
 
+    Returns:
+        One DeleteResult per resource, in plan order.
+    """
     # --- Initial Checks and Setup ---
     if not args.project_id: # Redundant due to required=True, but good practice
-        print("ERROR: --project-id is required.")
+        logger.error("--project-id is required.")
         sys.exit(1)
 
     print(f"--- ZNC Undeployment Script ---")
     print(f"Project ID: {args.project_id}")
     print(f"Zone: {args.zone}")
 
-    # Derive region from zone if static IP name is provided and region is not
+    # Region of the static IP; derived from --zone (required by argparse) unless given explicitly
+    resolved_region = args.region or (args.zone.rsplit('-', 1)[0] if args.static_ip_name else None)
     if args.static_ip_name and not args.region:
-        if args.zone:
-            args.region = args.zone.rsplit('-', 1)[0]
-            print(f"INFO: Derived region '{args.region}' from zone '{args.zone}' for static IP deletion.")
-        else:
-            # This case should ideally be caught by argparse if zone is always required with static-ip-name logic,
-            # but an explicit check is safer. Zone is already required=True, so this path might be hard to reach.
-            print("ERROR: --zone is required to derive the region for static IP deletion if --region is not explicitly provided.")
-            sys.exit(1)
-    elif args.static_ip_name and args.region:
-        print(f"Region for Static IP: {args.region}")
-
+        logger.info("Derived region '%s' from zone '%s' for static IP deletion.", resolved_region, args.zone)
+    elif args.static_ip_name:
+        print(f"Region for Static IP: {resolved_region}")
 
     # --- Summary of Actions ---
     print("\n--- Planned Actions ---")
     print(f"1. Delete VM Instance: '{args.instance_name}' in zone '{args.zone}'.")
     if args.static_ip_name:
-        if args.region:
-            print(f"2. Delete Static IP: '{args.static_ip_name}' in region '{args.region}'.")
-        else: # Should not happen due to derivation logic or if region becomes required with static_ip_name
-            print(f"WARNING: Static IP '{args.static_ip_name}' specified, but region is missing. Skipping its deletion.")
+        print(f"2. Delete Static IP: '{args.static_ip_name}' in region '{resolved_region}'.")
     else:
         print("2. Delete Static IP: Skipped (no --static-ip-name provided).")
 
@@ -232,8 +280,12 @@ if __name__ == "__main__":
         print("3. Delete Firewall Rule: Skipped (no --firewall-rule-name provided).")
 
 
-    # --- Confirmation (Placeholder for now) ---
+    # --- Confirmation ---
     if not args.yes:
+        # Without a terminal, input() would raise EOFError (stdin at /dev/null) or block forever
+        if not sys.stdin.isatty():
+            logger.error("--yes required for non-interactive runs.")
+            sys.exit(2)
         print("\nIMPORTANT: This script will attempt to delete the resources listed above.")
         confirmation = input("Are you sure you want to proceed? (yes/no): ")
         if confirmation.lower() != 'yes':
@@ -241,71 +293,125 @@ if __name__ == "__main__":
             sys.exit(0)
         print("Proceeding with undeployment...")
     else:
-        print("\nINFO: --yes flag detected, bypassing confirmation.")
+        logger.info("--yes flag detected, bypassing confirmation.")
 
     # --- Execute Deletion Operations ---
     print("\n--- Starting Deprovisioning Process ---")
-    results = {
-        "vm": "NOT_ATTEMPTED",
-        "static_ip": "NOT_ATTEMPTED",
-        "firewall": "NOT_ATTEMPTED"
-    }
-
-    # 1. Delete VM Instance
-    print("\n--- Deleting VM Instance ---")
-    if delete_vm_instance(args.project_id, args.zone, args.instance_name):
-        results["vm"] = "DELETED"
-        print(f"INFO: VM Instance '{args.instance_name}' deletion successful or already deleted.")
-    else:
-        results["vm"] = "FAILED"
-        print(f"ERROR: VM Instance '{args.instance_name}' deletion failed. Check logs above.")
 
-    # 2. Delete Static IP Address (if specified)
-    if args.static_ip_name:
-        print("\n--- Deleting Static IP Address ---")
-        actual_region_for_ip = args.region # Region might have been derived earlier or provided
-        if not actual_region_for_ip: # Should have been caught by initial derivation, but double check
-            print(f"ERROR: Region for static IP '{args.static_ip_name}' could not be determined (was --zone provided?). Skipping IP deletion.")
-            results["static_ip"] = "FAILED (Missing Region)"
+    # The firewall rule is deleted concurrently with the VM. The static IP must wait for the VM,
+    # since an address still attached to an instance cannot be deleted.
+    # Each worker spends its time waiting on the Compute API, so threads are sufficient.
+    # Jobs are (resource, name, detail, future) in summary order; the future is None if skipped.
+    jobs = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        # 1. Delete VM Instance
+        print("\n--- Deleting VM Instance ---")
+        vm_future = executor.submit(delete_vm_instance, args.project_id, args.zone, args.instance_name)
+        jobs.append(("VM Instance", args.instance_name, f"(zone '{args.zone}')", vm_future))
+
+        # 2. Delete Static IP Address (if specified)
+        if args.static_ip_name:
+            print("\n--- Deleting Static IP Address ---")
+            jobs.append(("Static IP", args.static_ip_name, f"(region '{resolved_region}')",
+                         executor.submit(_delete_static_ip_after_vm, vm_future, args.project_id, resolved_region, args.static_ip_name)))
+        else:
+            jobs.append(("Static IP", "", "(no --static-ip-name provided)", None))
+            print("\n--- Deleting Static IP Address: SKIPPED (No --static-ip-name provided) ---")
+
+        # 3. Delete Firewall Rule
+        # firewall_rule_name has a default, so it will usually be attempted unless user explicitly provides an empty string.
+        if args.firewall_rule_name:
+            print("\n--- Deleting Firewall Rule ---")
+            jobs.append(("Firewall Rule", args.firewall_rule_name, "",
+                         executor.submit(delete_firewall_rule, args.project_id, args.firewall_rule_name)))
         else:
-            if delete_static_ip(args.project_id, actual_region_for_ip, args.static_ip_name):
-                results["static_ip"] = "DELETED"
-                print(f"INFO: Static IP '{args.static_ip_name}' deletion successful or already deleted from region '{actual_region_for_ip}'.")
+            # This case is unlikely given the default value for firewall_rule_name.
+            jobs.append(("Firewall Rule", "", "(no --firewall-rule-name provided)", None))
+            print("\n--- Deleting Firewall Rule: SKIPPED (No --firewall-rule-name provided) ---")
+
+        # Report each deletion as soon as it finishes
+        labels = {future: f"{resource} '{name}'" for resource, name, _, future in jobs if future is not None}
+        for future in concurrent.futures.as_completed(labels):
+            if future.result():
+                logger.info("%s deletion successful or already deleted.", labels[future])
             else:
-                results["static_ip"] = "FAILED"
-                print(f"ERROR: Static IP '{args.static_ip_name}' deletion failed in region '{actual_region_for_ip}'. Check logs above.")
-    else:
-        results["static_ip"] = "SKIPPED (Not Provided)"
-        print("\n--- Deleting Static IP Address: SKIPPED (No --static-ip-name provided) ---")
+                logger.error("%s deletion failed. Check logs above.", labels[future])
 
+    return [
+        DeleteResult(resource, name, "SKIPPED" if future is None else ("DELETED" if future.result() else "FAILED"), detail)
+        for resource, name, detail, future in jobs
+    ]
 
-    # 3. Delete Firewall Rule
-    # firewall_rule_name has a default, so it will usually be attempted unless user explicitly provides an empty string.
-    if args.firewall_rule_name:
-        print("\n--- Deleting Firewall Rule ---")
-        if delete_firewall_rule(args.project_id, args.firewall_rule_name):
-            results["firewall"] = "DELETED"
-            print(f"INFO: Firewall Rule '{args.firewall_rule_name}' deletion successful or already deleted.")
-        else:
-            results["firewall"] = "FAILED"
-            print(f"ERROR: Firewall Rule '{args.firewall_rule_name}' deletion failed. Check logs above.")
-    else:
-        # This case is unlikely given the default value for firewall_rule_name.
-        results["firewall"] = "SKIPPED (No Name Provided)"
-        print("\n--- Deleting Firewall Rule: SKIPPED (No --firewall-rule-name provided) ---")
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Runs the undeployment end to end.
+
+    Args:
+        argv: Command-line arguments to parse instead of sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(
+        description="Undeploy ZNC VM and associated resources from Google Cloud.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    # --- Required Arguments ---
+    req_group = parser.add_argument_group("Required Arguments")
+    req_group.add_argument("--project-id", required=True, help="Google Cloud Project ID.")
+    req_group.add_argument("--zone", required=True, help="Compute zone of the VM instance (e.g., us-central1-c).")
+
+    # --- VM Deletion Arguments ---
+    vm_group = parser.add_argument_group("VM Deletion")
+    vm_group.add_argument("--instance-name", default="znc-bouncer-vm", help="Name of the VM instance to delete.")
+
+    # --- Static IP Deletion Arguments ---
+    ip_group = parser.add_argument_group("Static IP Deletion")
+    ip_group.add_argument("--static-ip-name", help="Name of the static IP address to delete. If not provided, static IP deletion will be skipped.")
+    ip_group.add_argument("--region", help="Region of the static IP address. Required if --static-ip-name is provided; can be derived from --zone if not set.")
+
+    # --- Firewall Deletion Arguments ---
+    fw_group = parser.add_argument_group("Firewall Deletion")
+    fw_group.add_argument("--firewall-rule-name", default="allow-znc-access", help="Name of the firewall rule to delete.")
+
+    # --- Control Arguments ---
+    control_group = parser.add_argument_group("Control Arguments")
+    control_group.add_argument("--yes", action='store_true', default=False, help="Bypass interactive confirmation for deletions.")
+    control_group.add_argument("--output", choices=["text", "json"], default="text", help="Format of the final deprovisioning summary.")
+
+    args = parser.parse_args(argv)
+
+    # With --output json, stdout carries only the JSON summary. The plan, prompt and log lines go to stderr.
+    human_output = sys.stderr if args.output == "json" else sys.stdout
+
+    # Log to the same stream as the plan and summary output so their lines stay in order. The handler
+    # is attached to this module's logger for this call only, so the root logger of a host process
+    # (or of an earlier call) is neither changed nor used.
+    log_handler = logging.StreamHandler(human_output)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    previous_level, previous_propagate = logger.level, logger.propagate
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        with contextlib.redirect_stdout(human_output):
+            results = _run_undeploy(args)
+    finally:
+        logger.removeHandler(log_handler)
+        logger.setLevel(previous_level)
+        logger.propagate = previous_propagate
 
     # --- Final Summary ---
+    if args.output == "json":
+        print(json.dumps([asdict(r) for r in results]))
+        return
+
     print("\n\n--- Deprovisioning Summary ---")
-    print(f"  VM Instance ('{args.instance_name}'): {results['vm']}")
+    for r in results:
+        label = f"{r.resource} ('{r.name}')" if r.name else r.resource
+        print(f"  {label}: {r.status} {r.detail}".rstrip())
 
-    if args.static_ip_name: # Only show static IP details if it was part of the command
-        print(f"  Static IP ('{args.static_ip_name}', Region: '{args.region if args.region else 'Derived from zone'}'): {results['static_ip']}")
-    else:
-        print(f"  Static IP: {results['static_ip']}") # Will show SKIPPED
+    print("\nDeprovisioning process complete. Please review the logs above for details and verify resource deletion in the Google Cloud Console.")
 
-    if args.firewall_rule_name: # Only show firewall details if it was part of the command (it has a default)
-        print(f"  Firewall Rule ('{args.firewall_rule_name}'): {results['firewall']}")
-    else:
-        print(f"  Firewall Rule: {results['firewall']}") # Will show SKIPPED
 
-    print("\nDeprovisioning process complete. Please review the logs above for details and verify resource deletion in the Google Cloud Console.")
+if __name__ == "__main__":
+    main()